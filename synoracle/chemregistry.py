@@ -0,0 +1,122 @@
+"""
+A module containing a corpus-wide registry of the chemical names and aliases found by ChemicalTagger.
+Names are interned to integer IDs so that the same reagent mentioned across many paragraphs is stored once,
+and the normalised form of each name is only ever computed once.
+
+Classes:
+ChemicalRegistry - interns chemical names to integer IDs and caches their normalised forms
+"""
+import re
+import unicodedata
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+
+class ChemicalRegistry:
+    """
+    A registry of every chemical name and alias seen across a corpus of synthesis paragraphs.
+    Each distinct string gets an integer ID on first sight, and each ID is mapped to the ID of its normalised form.
+    Pass a single instance to every SynParagraph in a corpus run to share it.
+
+    Key methods:
+    : intern: returns the integer ID for a name, registering it if it hasn't been seen before
+    : lookup: returns the string for a given ID
+    : normalise: returns the ID of the normalised form of a name, cached per name
+    : register_molecule: interns a list of aliases and a preferred name from find_chemical_name
+    : usage_table: cross-references extracted sequences against the registry, for cross-paper aggregation
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._normalised: Dict[int, int] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def intern(self, name: str) -> int:
+        """
+        Finds the ID of a chemical name, adding it to the registry if needed
+        :param name: the chemical name as found in the text
+        :return: the integer ID of the name
+        """
+        try:
+            return self._ids[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._ids:
+                    self._ids[name] = len(self._names)
+                    self._names.append(name)
+                return self._ids[name]
+
+    def lookup(self, name_id: int) -> str:
+        """
+        Returns the name registered under a given ID
+        :param name_id: the integer ID from intern
+        :return: the (shared) name string
+        """
+        return self._names[name_id]
+
+    @staticmethod
+    def _normal_form(name: str) -> str:
+        """
+        Produces a normalised version of a chemical name for grouping, e.g. 'Zinc  nitrate ' -> 'zinc nitrate'
+        :param name: the raw chemical name
+        :return: the normalised string
+        """
+        working = unicodedata.normalize('NFKC', name)
+        working = re.sub(r'\s+', ' ', working).strip(' .,;:')
+        return working.lower()
+
+    def normalise(self, name: str) -> int:
+        """
+        Finds the ID of the normalised form of a name. The normalisation is only computed the first time a name is seen.
+        :param name: the raw chemical name
+        :return: the integer ID of the normalised name
+        """
+        name_id = self.intern(name)
+        try:
+            return self._normalised[name_id]
+        except KeyError:
+            normal_id = self.intern(self._normal_form(name))
+            self._normalised[name_id] = normal_id
+            self._normalised.setdefault(normal_id, normal_id)
+            return normal_id
+
+    def register_molecule(self, aliases: Iterable[str], mol_name: str) -> Tuple[Tuple[int, ...], int]:
+        """
+        Interns the output of SynParagraph.find_chemical_name
+        :param aliases: the list of names used for the chemical
+        :param mol_name: the preferred name of the chemical
+        :return: a tuple of the alias IDs and the ID of the preferred name
+        """
+        return tuple(self.intern(x) for x in aliases), self.intern(mol_name)
+
+    def usage_table(self, syntheses: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """
+        Lists every chemical mention across a set of extracted syntheses, grouped by normalised name.
+        Chemicals must have been registered by this registry (i.e. have a 'name_id' key).
+        :param syntheses: a dictionary of {paragraph identifier: SynParagraph.raw_synthesis}
+        :return: a DataFrame with one row per chemical mention, with paragraph, step and normalised chemical name
+        """
+        rows = []
+        for paragraph_id, sequence in syntheses.items():
+            for _, step in sequence.iterrows():
+                for chemical in step['new_chemicals']:
+                    normal_id = self.normalise(self.lookup(chemical['name_id']))
+                    rows.append({
+                        'paragraph': paragraph_id,
+                        'step number': step['step number'],
+                        'action': step['name'],
+                        'name_id': chemical['name_id'],
+                        'normalised_id': normal_id,
+                        'normalised_name': self.lookup(normal_id),
+                    })
+        return pd.DataFrame(rows, columns=['paragraph', 'step number', 'action', 'name_id', 'normalised_id',
+                                           'normalised_name'])
@@ -0,0 +1,265 @@
+"""
+A module for resolving the chemical names extracted by SynParagraph into database records (CID, formula, etc.).
+Names are de-duplicated across a corpus run, looked up through a pluggable backend (PubChem or an offline SQLite
+snapshot), and kept in a local SQLite cache so that each name is only ever looked up once.
+
+Classes:
+ResolverBackend - the interface that lookup backends implement
+PubChemBackend - looks names up on PubChem through pubchempy
+SnapshotBackend - looks names up in a local SQLite snapshot, for offline runs
+ChemicalResolver - de-duplicates, caches and resolves chemical names through a backend
+
+Exceptions:
+ResolutionError - Raised if a backend cannot be used to look names up
+"""
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+
+class ResolutionError(Exception): pass
+
+
+RECORD_FIELDS = ['cid', 'iupac_name', 'molecular_formula', 'molecular_weight', 'smiles']
+
+
+def _clean_name(name: str) -> str:
+    """ The lookup key for a name: whitespace collapsed and case-folded, so 'Methanol' and 'methanol' match"""
+    return ' '.join(name.split()).casefold()
+
+
+class ResolverBackend:
+    """
+    The interface for chemical name lookups. Backends take a list of unique names and return what they found out.
+    """
+    name = 'base'
+
+    def lookup(self, names: List[str]) -> Dict[str, Optional[dict]]:
+        """
+        Looks up a batch of chemical names
+        :param names: a list of unique chemical names
+        :return: a dictionary of {name: record} for names found and {name: None} for names that don't exist;
+            names that couldn't be looked up (e.g. network errors) are left out, so they are retried later
+        """
+        raise NotImplementedError
+
+
+class PubChemBackend(ResolverBackend):
+    """
+    Looks up chemical names on PubChem using pubchempy, one request per name (PubChem has no batch name search).
+    Requests are spaced out to stay under the PubChem rate limit of five requests per second.
+    """
+    name = 'pubchem'
+
+    def __init__(self, request_interval: float = 0.2):
+        """
+        :param request_interval: the minimum time in seconds between requests to PubChem
+        """
+        try:
+            import pubchempy
+        except ImportError as e:
+            raise ResolutionError('pubchempy is needed for PubChem lookups: pip install pubchempy') from e
+        self._pcp = pubchempy
+        self.request_interval = request_interval
+
+    def lookup(self, names: List[str]) -> Dict[str, Optional[dict]]:
+        output = {}
+        for name in names:
+            start = time.monotonic()
+            try:
+                compounds = self._pcp.get_compounds(name, 'name')
+            except self._pcp.NotFoundError:
+                compounds = []
+            except (self._pcp.PubChemHTTPError, OSError) as e:
+                # server busy, timeouts, URLError etc.: leave the name out so it isn't cached as a miss
+                logging.warning(f'PubChem lookup failed for {name}: {e}')
+                compounds = None
+            if compounds == []:
+                output[name] = None
+            elif compounds:
+                compound = compounds[0]
+                output[name] = {
+                    'cid': compound.cid,
+                    'iupac_name': compound.iupac_name,
+                    'molecular_formula': compound.molecular_formula,
+                    'molecular_weight': float(compound.molecular_weight) if compound.molecular_weight else None,
+                    'smiles': compound.isomeric_smiles,
+                }
+            wait = self.request_interval - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+        return output
+
+
+class SnapshotBackend(ResolverBackend):
+    """
+    Looks up chemical names in a local SQLite snapshot, with a 'compounds' table keyed on names cleaned the same way as
+    ChemicalResolver's keys (whitespace collapsed and case-folded).
+    Snapshots can be written from any set of records (e.g. an earlier PubChem run) with SnapshotBackend.write.
+    """
+    name = 'snapshot'
+
+    def __init__(self, snapshot_path: Union[str, Path]):
+        """
+        :param snapshot_path: the location of the SQLite snapshot
+        """
+        self.snapshot_path = Path(snapshot_path)
+        if not self.snapshot_path.is_file():
+            raise ResolutionError(f'Cannot find chemical snapshot at {self.snapshot_path}')
+
+    @staticmethod
+    def write(snapshot_path: Union[str, Path], records: Dict[str, dict]):
+        """
+        Writes (or adds to) a snapshot database
+        :param snapshot_path: the location of the SQLite snapshot
+        :param records: a dictionary of {name: record}, where records contain the fields in RECORD_FIELDS
+        :return: None
+        """
+        with sqlite3.connect(str(snapshot_path)) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS compounds (name TEXT PRIMARY KEY, cid INTEGER, iupac_name TEXT, '
+                         'molecular_formula TEXT, molecular_weight REAL, smiles TEXT)')
+            conn.executemany('INSERT OR REPLACE INTO compounds VALUES (?, ?, ?, ?, ?, ?)',
+                             [(_clean_name(k), *[v.get(x) for x in RECORD_FIELDS]) for k, v in records.items()])
+        conn.close()
+
+    def lookup(self, names: List[str]) -> Dict[str, Optional[dict]]:
+        output = dict.fromkeys(names)
+        keys = {}
+        for x in names:
+            keys.setdefault(_clean_name(x), []).append(x)
+        conn = sqlite3.connect(str(self.snapshot_path))
+        try:
+            working = list(keys)
+            for i in range(0, len(working), 500):  # stays under the SQLite bound parameter limit
+                batch = working[i:i + 500]
+                rows = conn.execute(f'SELECT name, {", ".join(RECORD_FIELDS)} FROM compounds '
+                                    f'WHERE name IN ({", ".join("?" * len(batch))})', batch)
+                for row in rows:
+                    for name in keys[row[0]]:
+                        output[name] = dict(zip(RECORD_FIELDS, row[1:]))
+        finally:
+            conn.close()
+        return output
+
+
+class ChemicalResolver:
+    """
+    Resolves chemical names from SynParagraph outputs to database records.
+    Each name is looked up at most once per corpus run: first in memory, then in the local cache, and only then
+    through the backend. Names are matched case-insensitively. Names the backend can't find are cached too, so
+    misses aren't repeated either, but names that failed to look up (e.g. network errors) are left uncached and retried.
+    Backend results are cached a chunk at a time, so an interrupted run keeps what it has already looked up.
+
+    Key methods:
+    : resolve: resolves a list of names, returning a dictionary of records (None for names not found)
+    : resolve_synthesis: resolves every chemical in a SynParagraph.raw_synthesis and returns them as a DataFrame
+    : clear_expired: removes cache entries older than the time-to-live
+    """
+
+    def __init__(self, backend: ResolverBackend, cache_path: Union[str, Path] = './chemical_cache.sqlite',
+                 ttl: float = 30 * 24 * 3600, chunk_size: int = 50):
+        """
+        :param backend: the backend to look names up with, e.g. PubChemBackend() or SnapshotBackend(path)
+        :param cache_path: the location of the local SQLite cache, which is created if needed
+        :param ttl: how long cache entries stay valid for, in seconds (defaults to 30 days)
+        :param chunk_size: the number of names sent to the backend at a time; each chunk is cached as it completes
+        """
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.cache_path = Path(cache_path)
+        self.ttl = ttl
+        self._resolved: Dict[str, Optional[dict]] = {}
+        self.lookup_count = 0
+        with sqlite3.connect(str(self.cache_path)) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS resolved (name TEXT, backend TEXT, cid INTEGER, iupac_name TEXT, '
+                         'molecular_formula TEXT, molecular_weight REAL, smiles TEXT, found INTEGER, '
+                         'resolved_at REAL, PRIMARY KEY (name, backend))')
+        conn.close()
+
+    def _read_cache(self, names: List[str]) -> Dict[str, Optional[dict]]:
+        output = {}
+        oldest = time.time() - self.ttl
+        conn = sqlite3.connect(str(self.cache_path))
+        try:
+            for i in range(0, len(names), 500):
+                batch = names[i:i + 500]
+                rows = conn.execute(f'SELECT name, found, {", ".join(RECORD_FIELDS)} FROM resolved '
+                                    f'WHERE backend = ? AND resolved_at >= ? AND name IN ({", ".join("?" * len(batch))})',
+                                    [self.backend.name, oldest, *batch])
+                for row in rows:
+                    output[row[0]] = dict(zip(RECORD_FIELDS, row[2:])) if row[1] else None
+        finally:
+            conn.close()
+        return output
+
+    def _write_cache(self, results: Dict[str, Optional[dict]]):
+        now = time.time()
+        rows = []
+        for name, record in results.items():
+            record = record or {}
+            rows.append((name, self.backend.name, *[record.get(x) for x in RECORD_FIELDS], int(bool(record)), now))
+        with sqlite3.connect(str(self.cache_path)) as conn:
+            conn.executemany('INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.close()
+
+    def resolve(self, names: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """
+        Resolves a batch of chemical names, de-duplicating them and only sending unseen names to the backend
+        :param names: any iterable of chemical names, duplicates allowed
+        :return: a dictionary of {name: record}, with None for names that couldn't be resolved
+        """
+        wanted = {}
+        for name in names:
+            if not isinstance(name, str) or name == 'unknown':
+                continue
+            wanted.setdefault(name, _clean_name(name))
+
+        missing = sorted({x for x in wanted.values() if x and x not in self._resolved})
+        if missing:
+            self._resolved.update(self._read_cache(missing))
+            missing = [x for x in missing if x not in self._resolved]
+        if missing:
+            logging.info(f'Looking up {len(missing)} chemical names with the {self.backend.name} backend')
+            failed = 0
+            for i in range(0, len(missing), self.chunk_size):
+                chunk = missing[i:i + self.chunk_size]
+                results = {k: v for k, v in self.backend.lookup(chunk).items() if k in chunk}
+                self.lookup_count += len(chunk)
+                failed += len(chunk) - len(results)
+                self._write_cache(results)
+                self._resolved.update(results)
+            if failed:
+                logging.warning(f'{failed} chemical name(s) could not be looked up and will be retried next time')
+
+        return {k: self._resolved.get(v) for k, v in wanted.items()}
+
+    def resolve_synthesis(self, raw_synthesis: pd.DataFrame) -> pd.DataFrame:
+        """
+        Resolves every chemical mentioned in an extracted synthesis sequence
+        :param raw_synthesis: the SynParagraph.raw_synthesis DataFrame
+        :return: a DataFrame with one row per chemical mention: step number, name and the fields in RECORD_FIELDS
+        """
+        mentions = []
+        for _, step in raw_synthesis.iterrows():
+            for chemical in step['new_chemicals']:
+                mentions.append((step['step number'], chemical['name']))
+        records = self.resolve(x[1] for x in mentions)
+        rows = []
+        for step_number, name in mentions:
+            record = records.get(name) or {}
+            rows.append({'step number': step_number, 'name': name, **{x: record.get(x) for x in RECORD_FIELDS}})
+        return pd.DataFrame(rows, columns=['step number', 'name', *RECORD_FIELDS])
+
+    def clear_expired(self) -> int:
+        """
+        Deletes cache entries older than the time-to-live
+        :return: the number of entries removed
+        """
+        with sqlite3.connect(str(self.cache_path)) as conn:
+            removed = conn.execute('DELETE FROM resolved WHERE resolved_at < ?', (time.time() - self.ttl,)).rowcount
+        conn.close()
+        return removed
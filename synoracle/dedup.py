@@ -0,0 +1,173 @@
+"""
+A module for spotting synthesis paragraphs that have already been processed. Exact copies are found by hashing the
+normalised text, and can safely reuse the original's ChemicalTagger XML and extracted sequence. Near-copies are found
+with MinHash signatures and locality-sensitive hashing; these include the same general procedure with a different
+reagent (swapping one chemical name typically still scores above 0.9), so they are for provenance, not reuse.
+
+Classes:
+ParagraphIndex - an index of processed paragraphs for finding exact and near-duplicates
+"""
+import hashlib
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class ParagraphIndex:
+    """
+    An index of paragraphs already processed, keyed on their identifiers (e.g. '<paper id>.<paragraph number>').
+    Paragraphs are compared on word shingles (runs of consecutive tokens); the Jaccard similarity of two paragraphs'
+    shingle sets is estimated from their MinHash signatures. LSH splits each signature into bands, so only paragraphs
+    that share at least one band are compared, and the index stays fast as it grows.
+
+    With the defaults (128 permutations in 16 bands of 8), paragraphs more than ~70% similar are very likely to be
+    compared, and they are reported as duplicates if their estimated similarity is above the threshold.
+    Save the index after a run and load it in the next to find duplicates across runs.
+
+    Key methods:
+    : signature: computes the MinHash signature of a text
+    : exact_match: finds a paragraph in the index with the same normalised text
+    : query: finds the most similar paragraph in the index, if any is above the threshold
+    : add: adds a paragraph to the index
+    : save: writes the index to a .npz file
+    : load: reads an index written by save
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 16, shingle_size: int = 5,
+                 seed: int = 1):
+        """
+        :param threshold: the estimated Jaccard similarity above which paragraphs count as duplicates
+        :param num_perm: the number of hash permutations in each signature
+        :param bands: the number of LSH bands; must divide num_perm
+        :param shingle_size: the number of tokens in each shingle
+        :param seed: the random seed for the hash permutations; indexes must share it to be comparable
+        """
+        if num_perm % bands:
+            raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self._seed = seed
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._exact: Dict[str, str] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._signatures
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        return re.findall(r'\w+|[^\w\s]', text.lower())
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Computes the MinHash signature of a text's shingles
+        :param text: the paragraph text
+        :return: an array of num_perm 32-bit hash minima
+        """
+        tokens = self._tokens(text)
+        n = self.shingle_size
+        shingles = {' '.join(tokens[i:i + n]) for i in range(max(len(tokens) - n + 1, 1))}
+        hashes = np.array([zlib.crc32(x.encode('utf-8')) for x in shingles], dtype=np.uint64)
+        # (a * h + b) mod p, truncated to 32 bits; the uint64 overflow is part of the hash
+        permuted = np.bitwise_and((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME, _MAX_HASH)
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _text_hash(self, text: str) -> str:
+        return hashlib.sha1(' '.join(self._tokens(text)).encode('utf-8')).hexdigest()
+
+    def exact_match(self, text: str) -> Optional[str]:
+        """
+        Finds a paragraph in the index with exactly the same text, ignoring case and whitespace
+        :param text: the paragraph text
+        :return: the matching paragraph's key, or None
+        """
+        return self._exact.get(self._text_hash(text))
+
+    def query(self, text: str, signature: np.ndarray = None) -> Tuple[Optional[str], float]:
+        """
+        Finds the paragraph in the index most similar to a text, if it is above the similarity threshold
+        :param text: the paragraph text
+        :param signature: the text's signature, if already computed
+        :return: a tuple of the matching paragraph's key (or None) and the estimated similarity (1.0 for exact copies)
+        """
+        original = self.exact_match(text)
+        if original is not None:
+            return original, 1.0
+        if signature is None:
+            signature = self.signature(text)
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band, []))
+        best, best_similarity = None, 0.0
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = key, similarity
+        if best_similarity >= self.threshold:
+            return best, best_similarity
+        return None, best_similarity
+
+    def add(self, key: str, text: str, signature: np.ndarray = None):
+        """
+        Adds a paragraph to the index
+        :param key: the paragraph's unique identifier
+        :param text: the paragraph text
+        :param signature: the text's signature, if already computed
+        :return: None
+        """
+        if signature is None:
+            signature = self.signature(text)
+        self._exact.setdefault(self._text_hash(text), key)
+        self._signatures[key] = signature
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band, []).append(key)
+
+    def save(self, path: Union[str, Path]):
+        """
+        Writes the index, with its settings, to a numpy .npz file
+        :param path: the file to write
+        :return: None
+        """
+        keys = list(self._signatures)
+        signatures = np.array([self._signatures[x] for x in keys], dtype=np.uint64).reshape(len(keys), self.num_perm)
+        np.savez_compressed(path, keys=np.array(keys, dtype=str), signatures=signatures,
+                            exact_hashes=np.array(list(self._exact), dtype=str),
+                            exact_keys=np.array(list(self._exact.values()), dtype=str),
+                            settings=np.array([self.threshold, self.num_perm, self.bands, self.shingle_size,
+                                               self._seed], dtype=float))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'ParagraphIndex':
+        """
+        Reads an index written by save
+        :param path: the .npz file
+        :return: the ParagraphIndex, with the same settings and paragraphs
+        """
+        with np.load(path, allow_pickle=False) as data:
+            threshold, num_perm, bands, shingle_size, seed = data['settings']
+            index = cls(threshold=float(threshold), num_perm=int(num_perm), bands=int(bands),
+                        shingle_size=int(shingle_size), seed=int(seed))
+            index._exact = dict(zip(data['exact_hashes'].tolist(), data['exact_keys'].tolist()))
+            for key, signature in zip(data['keys'].tolist(), data['signatures']):
+                index._signatures[key] = signature
+                for bucket, band in zip(index._buckets, index._band_keys(signature)):
+                    bucket.setdefault(band, []).append(key)
+        return index
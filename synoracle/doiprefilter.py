@@ -0,0 +1,288 @@
+"""
+A module for checking a list of DOIs before any scraping starts, so the (slow) Selenium browser is only started for
+papers that need it. DOIs are validated and de-duplicated, then looked up concurrently to find each one's article URL
+and whether it is an open access RSC paper, a subscription RSC paper, or not an RSC paper at all.
+
+Lookups go through a pluggable resolver: Crossref's REST API over pooled (keep-alive) HTTPS connections, or a static
+dictionary for offline runs and testing.
+
+Classes:
+DOIResolver - the interface that DOI lookup backends implement
+CrossrefResolver - looks DOIs up with the Crossref REST API
+StaticResolver - looks DOIs up in a dictionary, e.g. a mock for testing
+DOIPrefilter - validates, de-duplicates, resolves and classifies a list of DOIs
+
+Exceptions:
+DOIResolutionError - Raised if a resolver gets an unexpected response
+"""
+import http.client
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+import pandas as pd
+
+
+class DOIResolutionError(Exception): pass
+
+
+RSC_PREFIX = '10.1039'
+STATUSES = ['open-access', 'subscription', 'not-rsc', 'invalid', 'unresolved']
+
+_DOI_PATTERN = re.compile(r'^10\.\d{4,9}/\S+$')
+_DOI_URL_PREFIX = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', re.IGNORECASE)
+
+
+class DOIResolver:
+    """
+    The interface for DOI lookups. Resolvers must be safe to call from several threads at once.
+    """
+
+    def resolve(self, doi: str) -> Optional[dict]:
+        """
+        Looks up a single DOI
+        :param doi: a normalised DOI
+        :return: a dictionary with 'url', 'publisher' and 'licenses', or None if not found. Each licence is a
+            dictionary of 'URL', 'content-version' ('vor' for the published version, 'am' for the accepted
+            manuscript, etc.), 'start' (the date it applies from, as 'YYYY-MM-DD') and 'delay-in-days' (the embargo)
+        """
+        raise NotImplementedError
+
+
+class CrossrefResolver(DOIResolver):
+    """
+    Looks DOIs up with the Crossref REST API (api.crossref.org), which gives the article URL, the publisher and the
+    licences in one request. Each thread keeps its own HTTPS connection open between requests.
+    Crossref limits how many requests it takes at once; rate-limited (429) and unavailable (503) responses are
+    retried after the wait given in their Retry-After header, or with exponential backoff if there isn't one.
+    """
+    host = 'api.crossref.org'
+    retry_statuses = (429, 503)
+
+    def __init__(self, mailto: str = None, timeout: float = 10, max_retries: int = 5, backoff: float = 1,
+                 max_wait: float = 60):
+        """
+        :param mailto: a contact email, which puts requests in Crossref's faster 'polite' pool
+        :param timeout: the network timeout for each request, in seconds
+        :param max_retries: the number of times to retry a rate-limited or unavailable response
+        :param backoff: the wait before the first retry without a Retry-After header, doubled for each retry after
+        :param max_wait: the longest wait before any one retry, in seconds
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.user_agent = 'SynOracle-preprocessing' + (f' (mailto:{mailto})' if mailto else '')
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPSConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPSConnection(self.host, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _get(self, path: str) -> Tuple[http.client.HTTPResponse, bytes]:
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('GET', path, headers={'User-Agent': self.user_agent})
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, OSError):
+                # the server may have closed a kept-alive connection, so retry once on a fresh one
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def _retry_wait(self, retry_after: Optional[str], attempt: int) -> float:
+        """
+        Works out how long to wait before retrying a request
+        :param retry_after: the response's Retry-After header, in seconds or as an HTTP date, if any
+        :param attempt: the number of retries made so far
+        :return: the wait in seconds
+        """
+        wait = self.backoff * 2 ** attempt
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        return min(max(wait, 0), self.max_wait)
+
+    def resolve(self, doi: str) -> Optional[dict]:
+        path = '/works/' + quote(doi, safe='/')
+        for attempt in range(self.max_retries + 1):
+            response, body = self._get(path)
+            if response.status not in self.retry_statuses or attempt == self.max_retries:
+                break
+            wait = self._retry_wait(response.getheader('Retry-After'), attempt)
+            logging.info(f'Crossref returned HTTP {response.status} for {doi}, retrying in {wait:.1f} s')
+            time.sleep(wait)
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise DOIResolutionError(f'Crossref returned HTTP {response.status} for {doi}')
+        message = json.loads(body)['message']
+        return {
+            'url': message.get('resource', {}).get('primary', {}).get('URL', message.get('URL')),
+            'publisher': message.get('publisher'),
+            'licenses': [{
+                'URL': x['URL'],
+                'content-version': x.get('content-version'),
+                'start': _crossref_date(x.get('start')),
+                'delay-in-days': x.get('delay-in-days'),
+            } for x in message.get('license', []) if 'URL' in x],
+        }
+
+
+def _crossref_date(value: Optional[dict]) -> Optional[str]:
+    """ Converts a Crossref date object ({'date-parts': [[y, m, d]], 'date-time': ...}) to 'YYYY-MM-DD'"""
+    if not value:
+        return None
+    if value.get('date-time'):
+        return value['date-time'][:10]
+    parts = (value.get('date-parts') or [[None]])[0]
+    if not parts or parts[0] is None:
+        return None
+    parts = list(parts) + [1] * (3 - len(parts))
+    return f'{parts[0]:04d}-{parts[1]:02d}-{parts[2]:02d}'
+
+
+class StaticResolver(DOIResolver):
+    """
+    Looks DOIs up in a dictionary of {doi: record} (records as returned by DOIResolver.resolve). Useful as a mock
+    resolver for testing, or for re-running a prefilter from saved results. Every lookup is counted in self.calls.
+    """
+
+    def __init__(self, records: Dict[str, Optional[dict]]):
+        self.records = {k.lower(): v for k, v in records.items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def resolve(self, doi: str) -> Optional[dict]:
+        with self._lock:
+            self.calls.append(doi)
+        return self.records.get(doi)
+
+
+class DOIPrefilter:
+    """
+    Sorts a list of DOIs into those worth starting a browser for, before any scraping.
+    DOIs are normalised (URL and 'doi:' prefixes stripped, lower case), de-duplicated and checked for the right
+    form. Non-RSC DOIs are classified from their prefix alone; the rest are resolved concurrently, and only count as
+    non-RSC if the resolver names another publisher. Each DOI ends up with one of the statuses in STATUSES:
+    - open-access: an RSC paper whose published version (not just the accepted manuscript) is under a Creative
+      Commons licence that has already started, so no login is needed
+    - subscription: an RSC paper that needs a login to scrape
+    - not-rsc: not an RSC paper, so RSCScraper can't be used
+    - invalid: not a DOI
+    - unresolved: an RSC DOI that couldn't be looked up (not registered, or a network error)
+
+    Key methods:
+    : normalise: tidies up a single DOI
+    : run: classifies a list of DOIs, returning a DataFrame
+    : to_scrape: lists the DOIs that need scraping, grouped by whether they need a login
+    """
+
+    def __init__(self, resolver: DOIResolver = None, max_workers: int = 3):
+        """
+        :param resolver: the DOI resolver, defaults to a CrossrefResolver
+        :param max_workers: the number of lookups to make at once; keep it within Crossref's concurrency limit
+        """
+        self.resolver = resolver if resolver is not None else CrossrefResolver()
+        self.max_workers = max_workers
+        self.results = None
+
+    @staticmethod
+    def normalise(doi: str) -> str:
+        """
+        Strips whitespace and any URL or 'doi:' prefix from a DOI, and lower cases it (DOIs are case-insensitive)
+        :param doi: the DOI as given
+        :return: the normalised DOI
+        """
+        return _DOI_URL_PREFIX.sub('', doi.strip()).strip().lower()
+
+    def _classify(self, doi: str) -> dict:
+        """
+        Resolves and classifies a single (valid, RSC-prefixed) DOI
+        :param doi: the normalised DOI
+        :return: a dictionary of status and url
+        """
+        try:
+            record = self.resolver.resolve(doi)
+        except (DOIResolutionError, http.client.HTTPException, OSError, ValueError, KeyError) as e:
+            logging.warning(f'Could not resolve {doi}: {e}')
+            return {'status': 'unresolved', 'url': None}
+        if record is None:
+            return {'status': 'unresolved', 'url': None}
+        url = record.get('url')
+        publisher = record.get('publisher')
+        if publisher and 'royal society of chemistry' not in publisher.lower():
+            return {'status': 'not-rsc', 'url': url}
+        today = date.today().isoformat()
+        if any(self._is_open_licence(x, today) for x in record.get('licenses', [])):
+            return {'status': 'open-access', 'url': url}
+        return {'status': 'subscription', 'url': url}
+
+    @staticmethod
+    def _is_open_licence(licence: dict, today: str) -> bool:
+        """
+        Checks whether a licence makes the published article free to scrape
+        :param licence: a licence dictionary, as returned by DOIResolver.resolve
+        :param today: today's date as 'YYYY-MM-DD'
+        :return: True for a Creative Commons licence on the version of record that has started (i.e. not embargoed)
+        """
+        if 'creativecommons.org' not in licence.get('URL', '') or licence.get('content-version') != 'vor':
+            return False
+        if licence.get('start'):
+            return licence['start'] <= today
+        return not licence.get('delay-in-days')
+
+    def run(self, dois: Iterable[str]) -> pd.DataFrame:
+        """
+        Validates, de-duplicates and classifies a list of DOIs
+        :param dois: the DOIs, as strings in any common format
+        :return: a DataFrame indexed by normalised DOI, in first-seen order, with status and url columns
+        """
+        unique = {}
+        for doi in dois:
+            unique.setdefault(self.normalise(doi), {'status': None, 'url': None})
+
+        to_resolve = []
+        for doi, result in unique.items():
+            if not _DOI_PATTERN.match(doi):
+                result['status'] = 'invalid'
+            elif doi.split('/')[0] != RSC_PREFIX:
+                result['status'] = 'not-rsc'
+            else:
+                to_resolve.append(doi)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for doi, result in zip(to_resolve, executor.map(self._classify, to_resolve)):
+                unique[doi] = result
+
+        self.results = pd.DataFrame.from_dict(unique, orient='index', columns=['status', 'url'])
+        self.results.index.name = 'doi'
+        logging.info(f'DOI prefilter: {self.results["status"].value_counts().to_dict()}')
+        return self.results
+
+    def to_scrape(self) -> Dict[str, List[str]]:
+        """
+        Lists the DOIs from the last run that RSCScraper should be used on
+        :return: a dictionary with 'open-access' (no login needed) and 'subscription' lists of DOIs
+        """
+        if self.results is None:
+            raise DOIResolutionError('No DOIs prefiltered yet, call run first')
+        return {x: self.results.index[self.results['status'] == x].tolist() for x in ['open-access', 'subscription']}
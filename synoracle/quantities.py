@@ -0,0 +1,240 @@
+"""
+A module for turning the free-text quantities extracted by SynParagraph into numbers in standardised (SI) units.
+Strings are parsed in bulk using pandas string methods and precompiled patterns, rather than row by row, so a whole
+corpus of chemical mentions can be converted at once.
+
+Functions:
+parse_quantities - parses a series of quantity strings of a single kind into value and SI unit columns
+chemical_quantities - parses the quantities of every chemical mentioned in a set of extracted syntheses
+condition_quantities - parses the temperatures and times of every step in a set of extracted syntheses
+benchmark_against_pint - compares parse_quantities with row-by-row conversion using pint
+"""
+import logging
+import re
+import time
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+# {kind: (SI unit, {unit as written: (scale, offset)})}
+UNIT_TABLES = {
+    'MASS': ('kg', {
+        'kg': (1, 0), 'g': (1e-3, 0), 'mg': (1e-6, 0), 'µg': (1e-9, 0), 'μg': (1e-9, 0), 'ug': (1e-9, 0),
+        'ng': (1e-12, 0), 'gram': (1e-3, 0), 'grams': (1e-3, 0), 'milligram': (1e-6, 0), 'milligrams': (1e-6, 0),
+        'kilogram': (1, 0), 'kilograms': (1, 0),
+    }),
+    'VOLUME': ('m3', {
+        'm3': (1, 0), 'L': (1e-3, 0), 'l': (1e-3, 0), 'dm3': (1e-3, 0), 'mL': (1e-6, 0), 'ml': (1e-6, 0),
+        'cm3': (1e-6, 0), 'µL': (1e-9, 0), 'μL': (1e-9, 0), 'uL': (1e-9, 0), 'µl': (1e-9, 0), 'μl': (1e-9, 0),
+        'ul': (1e-9, 0), 'mm3': (1e-9, 0), 'litre': (1e-3, 0), 'litres': (1e-3, 0), 'liter': (1e-3, 0),
+        'liters': (1e-3, 0), 'millilitre': (1e-6, 0), 'millilitres': (1e-6, 0), 'milliliter': (1e-6, 0),
+        'milliliters': (1e-6, 0), 'microlitre': (1e-9, 0), 'microlitres': (1e-9, 0), 'microliter': (1e-9, 0),
+        'microliters': (1e-9, 0),
+    }),
+    'AMOUNT': ('mol', {
+        'kmol': (1e3, 0), 'mol': (1, 0), 'mole': (1, 0), 'moles': (1, 0), 'mmol': (1e-3, 0), 'millimole': (1e-3, 0),
+        'millimoles': (1e-3, 0), 'µmol': (1e-6, 0), 'μmol': (1e-6, 0), 'umol': (1e-6, 0), 'nmol': (1e-9, 0),
+    }),
+    'MOLAR': ('mol/m3', {
+        'M': (1e3, 0), 'mM': (1, 0), 'µM': (1e-3, 0), 'μM': (1e-3, 0), 'uM': (1e-3, 0), 'nM': (1e-6, 0),
+        'mol/L': (1e3, 0), 'mol/l': (1e3, 0), 'mol/dm3': (1e3, 0), 'mmol/L': (1, 0), 'mmol/l': (1, 0),
+        'mmol/dm3': (1, 0), 'µmol/L': (1e-3, 0), 'μmol/L': (1e-3, 0), 'umol/L': (1e-3, 0), 'µmol/l': (1e-3, 0),
+        'μmol/l': (1e-3, 0), 'umol/l': (1e-3, 0), 'molar': (1e3, 0),
+    }),
+    'PERCENT': ('fraction', {
+        '%': (1e-2, 0), 'wt%': (1e-2, 0), 'wt.%': (1e-2, 0), 'vol%': (1e-2, 0), 'vol.%': (1e-2, 0),
+        'mol%': (1e-2, 0), 'mol.%': (1e-2, 0), 'percent': (1e-2, 0),
+    }),
+    'TEMP': ('K', {
+        '°C': (1, 273.15), '℃': (1, 273.15), 'C': (1, 273.15), 'K': (1, 0), '°F': (5 / 9, 255.3722222222222),
+        'degC': (1, 273.15),
+    }),
+    'TIME': ('s', {
+        's': (1, 0), 'sec': (1, 0), 'secs': (1, 0), 'second': (1, 0), 'seconds': (1, 0), 'min': (60, 0),
+        'mins': (60, 0), 'minute': (60, 0), 'minutes': (60, 0), 'h': (3600, 0), 'hr': (3600, 0), 'hrs': (3600, 0),
+        'hour': (3600, 0), 'hours': (3600, 0), 'd': (86400, 0), 'day': (86400, 0), 'days': (86400, 0),
+        'week': (604800, 0), 'weeks': (604800, 0),
+    }),
+}
+
+# Phrases without a number that still have an unambiguous value, in SI units
+NAMED_QUANTITIES = {
+    'TEMP': {'room temperature': 298.15, 'ambient temperature': 298.15, 'r.t.': 298.15, 'rt': 298.15},
+    'TIME': {},
+}
+
+# keys of the chemical dictionaries produced by SynParagraph.find_chemicals, and the kind of quantity they hold
+CHEMICAL_QUANTITY_KINDS = {
+    'mass': 'MASS',
+    'other_amount': 'AMOUNT',
+    'volume': 'VOLUME',
+    'percent': 'PERCENT',
+    'concentration': 'MOLAR',
+}
+
+_NUMBER = r'\d+(?:\.\d+)?'
+_QUANTITY_PATTERN = re.compile(
+    rf'(?P<value>-?{_NUMBER})(?:\s*(?:-|–|to)\s*(?P<upper>-?{_NUMBER}))?\s*'
+    r'(?P<unit>°[CF]|℃|%|[A-Za-zµμ]+(?:\.?%|/[A-Za-zµμ]+\d?|\d)?)'
+)
+_THOUSANDS = re.compile(r'(?<![\d.,])([1-9]\d{0,2}),(\d{3})(?![\d,])')
+_DECIMAL_COMMA = re.compile(r'(\d),(\d)')
+_DEGREE_SPACE = re.compile(r'°\s+')
+_UNIT_SPACE = re.compile(r'(wt|vol|mol)\s*(\.?)\s*%')
+# concentrations written with a negative exponent, e.g. 'mol L-1', 'mol·L−1' or 'mol dm-3', to be rewritten as 'mol/L'
+_PER_VOLUME = re.compile(r'([mµμu]?mol)\s*[·⋅]?\s*(?:([Ll])\s*\^?-1|dm\s*\^?-3)\b')
+
+
+def parse_quantities(strings: Iterable, kind: str) -> pd.DataFrame:
+    """
+    Parses quantity strings such as '0.5 g' or 'at 65 °C' into numbers in SI units, all at once.
+    Ranges ('10-15 min') are given as their midpoint, and comma decimals ('0,2 g') are understood.
+    :param strings: any iterable of strings (or NaN) containing one kind of quantity
+    :param kind: one of 'MASS', 'VOLUME', 'AMOUNT', 'MOLAR', 'PERCENT', 'TEMP' or 'TIME'
+    :return: a DataFrame with the columns text, value, unit and parsed, in the same order as strings; unit is NaN
+        wherever parsed is False
+    """
+    try:
+        si_unit, table = UNIT_TABLES[kind]
+    except KeyError:
+        raise ValueError(f'Unknown quantity kind {kind}, must be one of {list(UNIT_TABLES)}')
+    text = pd.Series(strings, dtype=object)
+    index = text.index
+    text = text.where(text.map(lambda x: isinstance(x, str)), np.nan)
+
+    cleaned = (text.str.replace('−', '-', regex=False)
+               .str.replace(_THOUSANDS, r'\1\2', regex=True)
+               .str.replace(_DECIMAL_COMMA, r'\1.\2', regex=True)
+               .str.replace(_DEGREE_SPACE, '°', regex=True)
+               .str.replace(_UNIT_SPACE, r'\1\2%', regex=True)
+               .str.replace(_PER_VOLUME, lambda m: f"{m[1]}/{m[2] or 'dm3'}", regex=True))
+    found = cleaned.str.extract(_QUANTITY_PATTERN)
+
+    unit = found['unit'].astype(object)
+    unit = unit.where(unit.isin(table), unit.str.lower())
+    scale = unit.map({k: v[0] for k, v in table.items()}).astype(float)
+    offset = unit.map({k: v[1] for k, v in table.items()}).astype(float)
+
+    value = pd.to_numeric(found['value'], errors='coerce').astype(float)
+    upper = pd.to_numeric(found['upper'], errors='coerce').astype(float)
+    value = value.where(upper.isna(), (value + upper) / 2)
+    si_value = value * scale + offset
+
+    named = NAMED_QUANTITIES.get(kind)
+    if named:
+        lowered = cleaned.str.strip().str.lower().str.replace(r'^(at|under|in)\s+', '', regex=True)
+        si_value = si_value.fillna(lowered.map(named).astype(float))
+
+    output = pd.DataFrame({
+        'text': text,
+        'value': si_value.astype(float),
+        'unit': si_unit,
+        'parsed': si_value.notna(),
+    })
+    output.index = index
+    output.loc[~output['parsed'], 'unit'] = np.nan
+    return output
+
+
+def chemical_quantities(syntheses: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Flattens every chemical mention in a set of syntheses and parses their quantities, one kind at a time.
+    Quantities that were never mentioned are dropped; those mentioned but not understood are kept with parsed=False.
+    :param syntheses: a dictionary of {paragraph identifier: SynParagraph.raw_synthesis}
+    :return: a long DataFrame with one row per quantity: paragraph, step number, chemical index, name, quantity
+        type, text, value, SI unit and parsed
+    """
+    columns = ['paragraph', 'step number', 'chemical', 'name', 'quantity', 'text']
+    rows = []
+    for paragraph_id, sequence in syntheses.items():
+        for step_number, chemicals in zip(sequence['step number'], sequence['new_chemicals']):
+            for c, chemical in enumerate(chemicals):
+                for key in CHEMICAL_QUANTITY_KINDS:
+                    if isinstance(chemical.get(key), str):
+                        rows.append((paragraph_id, step_number, c, chemical['name'], key, chemical[key]))
+    mentions = pd.DataFrame(rows, columns=columns)
+    return _parse_by_kind(mentions, mentions['quantity'].map(CHEMICAL_QUANTITY_KINDS))
+
+
+def condition_quantities(syntheses: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Flattens the 'temp' and 'time' lists of every step in a set of syntheses and parses them.
+    :param syntheses: a dictionary of {paragraph identifier: SynParagraph.raw_synthesis}
+    :return: a long DataFrame with one row per condition: paragraph, step number, quantity ('temp' or 'time'),
+        text, value, SI unit and parsed
+    """
+    columns = ['paragraph', 'step number', 'quantity', 'text']
+    rows = []
+    for paragraph_id, sequence in syntheses.items():
+        for key in ['temp', 'time']:
+            for step_number, conditions in zip(sequence['step number'], sequence[key]):
+                rows.extend((paragraph_id, step_number, key, x) for x in conditions)
+    mentions = pd.DataFrame(rows, columns=columns)
+    return _parse_by_kind(mentions, mentions['quantity'].str.upper())
+
+
+def _parse_by_kind(mentions: pd.DataFrame, kinds: pd.Series) -> pd.DataFrame:
+    """
+    Runs parse_quantities once per kind of quantity over a long table of mentions
+    :param mentions: a DataFrame with a 'text' column
+    :param kinds: the kind of each row in mentions
+    :return: mentions with value, unit and parsed columns added
+    """
+    parsed = [parse_quantities(mentions.loc[kinds == kind, 'text'], kind) for kind in kinds.unique()]
+    if parsed:
+        parsed = pd.concat(parsed).reindex(mentions.index)
+    else:
+        parsed = pd.DataFrame(columns=['text', 'value', 'unit', 'parsed'], index=mentions.index)
+    output = mentions.copy()
+    output['value'] = parsed['value'].astype(float)
+    output['unit'] = parsed['unit']
+    output['parsed'] = parsed['parsed'].astype(bool)
+    unparsed = (~output['parsed']).sum()
+    if unparsed:
+        logging.info(f'{unparsed} of {len(output)} quantities could not be parsed')
+    return output
+
+
+def benchmark_against_pint(strings: Iterable[str], kind: str, repeat: int = 3) -> dict:
+    """
+    Times parse_quantities against converting the same strings one at a time with pint, as done in notebook 03.
+    Needs pint installed (it isn't a requirement of the package otherwise).
+    :param strings: a list of quantity strings of one kind
+    :param kind: the kind of quantity, as in parse_quantities
+    :param repeat: the number of times to repeat each approach; the best time is kept
+    :return: a dictionary of timings (seconds), the speedup, and the number of strings each approach understood
+    """
+    import pint
+    ureg = pint.UnitRegistry()
+    pint_units = {'kg': 'kg', 'm3': 'm**3', 'mol': 'mol', 'mol/m3': 'mol/m**3', 'fraction': 'dimensionless',
+                  'K': 'K', 's': 's'}
+    target = ureg(pint_units[UNIT_TABLES[kind][0]])
+    strings = list(strings)
+
+    def per_row():
+        converted = []
+        for x in strings:
+            try:
+                converted.append(ureg.Quantity(x).to(target.units).magnitude)
+            except Exception:
+                converted.append(np.nan)
+        return converted
+
+    vector_time, pint_time = np.inf, np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectorised = parse_quantities(strings, kind)
+        vector_time = min(vector_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        row_by_row = per_row()
+        pint_time = min(pint_time, time.perf_counter() - start)
+
+    return {
+        'n': len(strings),
+        'vectorised_seconds': vector_time,
+        'pint_seconds': pint_time,
+        'speedup': pint_time / vector_time,
+        'vectorised_parsed': int(vectorised['parsed'].sum()),
+        'pint_parsed': int(np.isfinite(np.array(row_by_row, dtype=float)).sum()),
+    }
@@ -16,7 +16,7 @@ from selenium.common.exceptions import NoSuchElementException
 import errno, os
 
 
-def CredentialError(Exception): pass
+class CredentialError(Exception): pass
 
 
 class RSCScraper:
@@ -211,16 +211,21 @@ class RSCScraper:
                 raise
         return f'{self.outputdir}/{doi_str}/'
 
-    def extract_from_doi(self, doi: str, username:str=None, password: str=None, output_type: str='Full'):
+    def extract_from_doi(self, doi: str, username:str=None, password: str=None, output_type: str='Full',
+                         needs_login: bool=True):
         """
         Combined workflow to download a paper from the RSC given a specific DOI.
+        Use synoracle.doiprefilter.DOIPrefilter first to weed out non-RSC DOIs and find the open access papers.
         TODO: add functionality for different modes of scraping (with images and SI or not)
         :param doi: the DOI of the article you want to download
         :param username: your username for the RSC
         :param password: your password for the RSC
         :param output_type: flag for if you want one folder per paper, or one folder with lots of papers in only
+        :param needs_login: set to False for open access papers to skip the credential check
         :return: None
         """
+        if doi.split('/')[0] != '10.1039':  # confirms it's an RSC paper before any browser work
+            raise ValueError(f'{doi} is not an RSC DOI')
         self.DOI = doi
         self.url = f'https://doi.org/{self.DOI}'
         out_dir = self._prepare_directory()
@@ -236,18 +241,17 @@ class RSCScraper:
         self.options.add_argument('--headless')
         self.options.add_argument('--disable-gpu')  # Last I checked this was necessary.
 
-        logged_in = self._check_credentials()
-        if not logged_in:
-            self._login(username=username, password=password)
-            sleep(1)
+        if needs_login:
             logged_in = self._check_credentials()
+            if not logged_in:
+                self._login(username=username, password=password)
+                sleep(1)
+                logged_in = self._check_credentials()
 
-        if not logged_in:
-            raise CredentialError('Cannot login to RSC!')
-
-        print(self.DOI.split('/')[0])
-        assert self.DOI.split('/')[0] == '10.1039'  # confirms it's an RSC paper
+            if not logged_in:
+                raise CredentialError('Cannot login to RSC!')
 
+        self.driver.get(self.url)  # the credential check leaves the browser elsewhere, or on a blank page if skipped
         self._extract_text(self.url)
         self.image_dict = {}
         try:
@@ -11,8 +11,11 @@ SynParagraph
 Exceptions:
 InputFileContentError
 InvalidInputError
+ChemTaggerError - a classified ChemicalTagger failure (timeout, non-zero exit, empty or malformed XML)
+ChemTaggerLaunchError - ChemicalTagger couldn't be started at all (e.g. no java, or no jar)
 """
 from lxml import etree
+import subprocess
 from lxml.etree import XMLSyntaxError, _Element
 import logging
 import numpy as np
@@ -23,6 +26,8 @@ from typing import Union
 from itertools import chain
 import re
 from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from synoracle.chemregistry import ChemicalRegistry
 
 # create logger
 logger = logging.getLogger('simple_example.txt')
@@ -38,6 +43,27 @@ class InputFileContentError(Exception): pass
 class InvalidInputError(Exception): pass
 
 
+class ChemTaggerError(InputFileContentError):
+    """
+    Raised when ChemicalTagger fails on a paragraph. The reason is one of CHEMTAGGER_FAILURES, and stderr holds
+    whatever ChemicalTagger printed (if it got that far).
+    """
+    def __init__(self, message: str, reason: str, stderr: str = ''):
+        super().__init__(message)
+        self.reason = reason
+        self.stderr = stderr
+
+
+class ChemTaggerLaunchError(Exception):
+    """
+    Raised when ChemicalTagger can't be started, e.g. java isn't installed or the jar isn't there. This is a setup
+    problem rather than a fault in any one paragraph, so it isn't a ChemTaggerError and batches shouldn't carry on.
+    """
+
+
+CHEMTAGGER_FAILURES = ['timeout', 'exit', 'empty', 'malformed']
+
+
 class SynParagraph:
     '''
     An object for taking in a raw text paragraph and producing a structured synthesis sequence.
@@ -58,20 +84,27 @@ class SynParagraph:
 
     '''
 
-    def __init__(self, paper_identifier: str, source_directory: Union[str, Path] = Path('./'), chemtagger_dir: Union[str, Path] = './', chemtagger_exec = 'chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar'):
+    def __init__(self, paper_identifier: str, source_directory: Union[str, Path] = Path('./'), chemtagger_dir: Union[str, Path] = './', chemtagger_exec = 'chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar',
+                 registry: ChemicalRegistry = None, chemtagger_timeout: float = 300, extract_workers: int = None):
         """
         Instantiates the object and concerts a text document to XML (if needed)
 
         :param paper_identifier: a unique string pointing to the synthesis paragraph as a text file
         :param source_directory: a string or path pointing to the directory where your input file is
+        :param registry: a ChemicalRegistry shared across a corpus, to store chemical mentions as integer IDs
+        :param chemtagger_timeout: the longest time in seconds ChemicalTagger may spend on the paragraph
+        :param extract_workers: the number of processes to extract sentences with, see extract_sequence
         """
         self.source_directory = Path(source_directory)
         print(source_directory)
         self.paper_indentifier = paper_identifier
+        self.registry = registry
+        self.duplicate_of = None
+        self.similar_to = None
         self.source_paragraph = self.source_directory / (paper_identifier + '.txt')
         #self.regex_preprocess()
-        self.load_xml(chemtagger_dir=chemtagger_dir, chemtagger_exec=chemtagger_exec)
-        self.extract_sequence()
+        self.load_xml(chemtagger_dir=chemtagger_dir, chemtagger_exec=chemtagger_exec, timeout=chemtagger_timeout)
+        self.extract_sequence(workers=extract_workers)
 
     def regex_preprocess(self):
         """
@@ -86,11 +119,13 @@ class SynParagraph:
             f2.write(rawtext2)
 
     def apply_chem_tagger(self, chemtagger_dir: Union[str, Path] = './',
-                          chemtagger_exec: str = 'chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar') -> Path:
+                          chemtagger_exec: str = 'chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar',
+                          timeout: float = 300) -> Path:
         """
         Applied ChemicalTagger to a specific paragraph, if an xml with the same name doesn't yet exist
         :param chemtagger_dir: The chemtagger executable location
         :param chemtagger_exec: Name of the chemtagger executable, in case you changed yours
+        :param timeout: The longest time in seconds ChemicalTagger may run for before it is killed
         :return: the directory path for the xml file generated
         """
         logging.debug(f"Applying chem tagger on {self.paper_indentifier}")
@@ -98,33 +133,50 @@ class SynParagraph:
         paragraph = self.source_paragraph
         function_output = self.source_directory / (self.paper_indentifier + '.xml')
 
+        if function_output.is_file():
+            return function_output
+
+        logging.info("Applying chemicaltagger to file {0}".format(paragraph))
+        jar = Path(chemtagger_dir) / chemtagger_exec
+        if not jar.is_file():
+            raise ChemTaggerLaunchError(f'ChemicalTagger jar not found at {jar}')
+        command = ['java', '-jar', str(jar), str(paragraph), str(function_output)]
         try:
-            assert function_output.is_file(), function_output
-        except AssertionError:
-            logging.info("Applying chemicaltagger to file {0}".format(paragraph))
-            import subprocess
-            subprocess.run(
-                f'java -jar {chemtagger_dir}{chemtagger_exec} "{paragraph}" "{function_output}"')
-            from time import sleep
-            sleep(10)
-            assert function_output.is_file(), function_output
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            function_output.unlink(missing_ok=True)
+            stderr = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else (e.stderr or '')
+            raise ChemTaggerError(f'ChemicalTagger timed out after {timeout} s on {paragraph}', 'timeout', stderr)
+        except OSError as e:
+            raise ChemTaggerLaunchError(f'Could not start ChemicalTagger: {e}') from e
+        if result.returncode != 0:
+            function_output.unlink(missing_ok=True)
+            raise ChemTaggerError(f'ChemicalTagger exited with code {result.returncode} on {paragraph}', 'exit',
+                                  result.stderr)
+        if not function_output.is_file() or function_output.stat().st_size == 0:
+            raise ChemTaggerError(f'ChemicalTagger produced no output for {paragraph}', 'empty', result.stderr)
         return function_output
 
-    def load_xml(self, chemtagger_dir='./', chemtagger_exec='chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar'):
+    def load_xml(self, chemtagger_dir='./', chemtagger_exec='chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar',
+                 timeout: float = 300):
         """
         Loads an XML file into memory as an ElementTree
         :return: None
         """
-        xml_filename = self.apply_chem_tagger(chemtagger_dir=chemtagger_dir, chemtagger_exec=chemtagger_exec)
+        xml_filename = self.apply_chem_tagger(chemtagger_dir=chemtagger_dir, chemtagger_exec=chemtagger_exec,
+                                              timeout=timeout)
         if not xml_filename.is_file():
             raise InvalidInputError(f"Cannot find extracted xml actions for paper {self.paper_indentifier}")
         with open(xml_filename, 'rb') as f:
             raw = f.read()
+        if len(raw.strip()) == 0:
+            raise ChemTaggerError(f'Empty xml actions file for paper {self.paper_indentifier}', 'empty')
         try:
             self.working_xml = etree.fromstring(raw)
         except XMLSyntaxError as e:
             logging.error('Cannot read extracted xml actions for paper {0}'.format(self.paper_indentifier))
-            raise InputFileContentError
+            raise ChemTaggerError(f'Cannot read extracted xml actions for paper {self.paper_indentifier}: {e}',
+                                  'malformed') from e
         logging.info('XML loaded in from {0}'.format(xml_filename.parts[-1]))
 
     def _text_annotate(self, text: str, start_char_list: list, end_char_list: list, texttype: list = ['bold']) -> str:
@@ -247,6 +299,7 @@ class SynParagraph:
     def find_chemicals(self, xml: _Element) -> List[dict]:
         """
         Iterates though an ActionPhrase to find all the mentions of chemicals and their quantities therein.
+        If a ChemicalRegistry is attached, the aliases are stored as a tuple of 'alias_ids' and a 'name_id' is added.
         :param xml: An ActionPhrase tag potentially containing chemicals
         :return: a list of chemical dictionaries containing information on name, aliases, and amounts of various types.
         """
@@ -266,9 +319,22 @@ class SynParagraph:
                 'concentration': self.find_chemical_quantity(chemical, tag='MOLAR'),
                 'aliases': aliases
             }
+            if self.registry is not None:
+                self._register_chemical(molec)
             outputs.append(molec)
         return outputs
 
+    def _register_chemical(self, molec: dict):
+        """
+        Swaps the aliases of a chemical dictionary from find_chemicals for their IDs in the attached ChemicalRegistry
+        :param molec: a chemical dictionary, modified in place
+        :return: None
+        """
+        alias_ids, name_id = self.registry.register_molecule(molec.pop('aliases'), molec['name'])
+        molec['name'] = self.registry.lookup(name_id)
+        molec['name_id'] = name_id
+        molec['alias_ids'] = alias_ids
+
     def parse_actionphrase(self, xml: _Element, counter: int) -> Tuple[dict, int]:
         """
         Processes a single action phrase for specific features and information of chemicals mentioned.
@@ -350,15 +416,57 @@ class SynParagraph:
             counter += 1
         return output, counter
 
-    def extract_sequence(self):
+    def extract_sequence(self, workers: int = None, pool: str = 'process', chunksize: int = 8):
         """
-        Performs process_actionphrases across all sentences within a paragraph, outputting as a pandas DataFrame
+        Performs process_actionphrases across all sentences within a paragraph, outputting as a pandas DataFrame.
+        For long paragraphs, sentences can be extracted independently in parallel: each one is numbered from zero,
+        then the step numbers are offset by the number of steps in the sentences before it. The result is the
+        same as the serial one.
+        :param workers: the number of workers to extract sentences with; None or 1 runs serially
+        :param pool: 'process' or 'thread'; processes are faster, since extraction mostly holds the GIL
+        :param chunksize: the number of sentences sent to a worker at a time
         :return: None
         """
+        if workers is None or workers <= 1:
+            raw_sequence = {}
+            counter = 0
+            placeholder = deepcopy(self.working_xml)
+            for x in placeholder.findall('Sentence'):
+                output, counter = self.process_actionphrases(x, counter)
+                raw_sequence = {**raw_sequence, **output}
+            self.raw_synthesis = pd.DataFrame(raw_sequence).T
+            return
+
+        sentences = [etree.tostring(x) for x in self.working_xml.findall('Sentence')]
+        executor = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}[pool]
+        with executor(max_workers=workers) as ex:
+            local_sequences = list(ex.map(_extract_sentence, sentences, chunksize=chunksize))
+
         raw_sequence = {}
         counter = 0
-        placeholder = deepcopy(self.working_xml)
-        for x in placeholder.findall('Sentence'):
-            output, counter = self.process_actionphrases(x, counter)
-            raw_sequence = {**raw_sequence, **output}
+        for local in local_sequences:
+            for k, step in local.items():
+                step['step number'] = k + counter
+                for molec in step['new_chemicals']:
+                    # unpickled NaNs aren't the np.nan object, so lists of chemicals would no longer compare equal
+                    for key, value in molec.items():
+                        if isinstance(value, float) and np.isnan(value):
+                            molec[key] = np.nan
+                    if self.registry is not None:
+                        self._register_chemical(molec)
+                raw_sequence[k + counter] = step
+            counter += len(local)
         self.raw_synthesis = pd.DataFrame(raw_sequence).T
+
+
+def _extract_sentence(sentence: bytes) -> dict:
+    """
+    Worker function for parallel SynParagraph.extract_sequence: extracts a serialised sentence with steps numbered
+    from zero. Chemicals are left unregistered, since a ChemicalRegistry can't be shared between processes.
+    :param sentence: a Sentence element serialised with etree.tostring
+    :return: the dictionary of steps from process_actionphrases
+    """
+    worker = SynParagraph.__new__(SynParagraph)  # no source files needed to process a sentence
+    worker.registry = None
+    output, _ = worker.process_actionphrases(etree.fromstring(sentence), 0)
+    return output
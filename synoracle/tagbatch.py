@@ -0,0 +1,197 @@
+"""
+A module for running SynParagraph over a batch of synthesis paragraphs without one bad paragraph stopping the rest.
+ChemicalTagger failures are classified, the offending inputs are quarantined with their stderr, and the batch carries on.
+Paragraphs that are exact copies of one already processed reuse its results instead of being tagged again.
+
+Classes:
+TaggingBatch - runs ChemicalTagger and sequence extraction over many paragraphs, quarantining failures
+"""
+import logging
+import shutil
+import traceback
+from copy import copy
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import pandas as pd
+
+from synoracle.chemregistry import ChemicalRegistry
+from synoracle.dedup import ParagraphIndex
+from synoracle.synparagraph import SynParagraph, ChemTaggerError, ChemTaggerLaunchError, CHEMTAGGER_FAILURES
+
+
+class TaggingBatch:
+    """
+    Processes a list of paragraph identifiers into SynParagraph objects, one at a time, with a hard time limit
+    on each ChemicalTagger run. Paragraphs that fail are recorded and copied to a quarantine folder
+    (one subfolder per failure reason) along with ChemicalTagger's stderr, so they can be looked at later.
+
+    Failure reasons are those of ChemTaggerError ('timeout', 'exit', 'empty', 'malformed'), plus 'extraction' for
+    errors raised while extracting the sequence from otherwise valid XML. If ChemicalTagger can't be started at all
+    (ChemTaggerLaunchError, e.g. java isn't installed), the batch stops rather than quarantining every paragraph.
+
+    If a ParagraphIndex is given, each paragraph is checked against those already processed first. Exact copies
+    reuse the original's sequence without running ChemicalTagger: their SynParagraph has duplicate_of set to the
+    original's identifier, and their raw_synthesis gains 'duplicate_of' and 'similarity' columns. Originals from
+    earlier runs (e.g. with an index from ParagraphIndex.load) are reloaded from their XML in source_directory; if
+    that XML is missing or can't be read, the duplicate is processed as normal instead.
+    Near-duplicates (e.g. the same procedure with a different reagent) are processed as normal, since their chemicals
+    differ, and are linked to the paragraph they resemble through similar_to. Set reuse_near_duplicates to reuse
+    their originals' results as well, accepting that the chemicals may be wrong.
+
+    Key methods:
+    : run: processes a list of paragraph identifiers, returning the successful SynParagraphs
+    : summary: counts the successes and each type of failure so far
+    """
+
+    def __init__(self, source_directory: Union[str, Path] = Path('./'), quarantine_dir: Union[str, Path] = None,
+                 chemtagger_dir: Union[str, Path] = './',
+                 chemtagger_exec: str = 'chemicalTagger-1.6-SNAPSHOT-jar-with-dependencies-file.jar',
+                 timeout: float = 300, registry: ChemicalRegistry = None, dedup: ParagraphIndex = None,
+                 reuse_near_duplicates: bool = False):
+        """
+        :param source_directory: the folder containing the paragraph text files
+        :param quarantine_dir: the folder to put failed inputs in, defaults to a 'quarantine' folder in source_directory
+        :param chemtagger_dir: The chemtagger executable location
+        :param chemtagger_exec: Name of the chemtagger executable
+        :param timeout: the longest time in seconds ChemicalTagger may spend on any one paragraph
+        :param registry: a ChemicalRegistry to pass to every SynParagraph
+        :param dedup: a ParagraphIndex of processed paragraphs, to skip tagging duplicates
+        :param reuse_near_duplicates: whether near-duplicates reuse their original's results too, not just exact copies
+        """
+        self.source_directory = Path(source_directory)
+        self.quarantine_dir = Path(quarantine_dir) if quarantine_dir else self.source_directory / 'quarantine'
+        self.chemtagger_dir = chemtagger_dir
+        self.chemtagger_exec = chemtagger_exec
+        self.timeout = timeout
+        self.registry = registry
+        self.dedup = dedup
+        self.reuse_near_duplicates = reuse_near_duplicates
+        self.succeeded = []
+        self.failures: Dict[str, dict] = {}
+        self.reused: Dict[str, dict] = {}
+        self.near_duplicates: Dict[str, dict] = {}
+
+    def _quarantine(self, paragraph_id: str, reason: str, message: str, stderr: str = ''):
+        """
+        Copies a failed paragraph (and moves any bad XML output) to the quarantine folder, with a log of the error
+        :param paragraph_id: the paragraph identifier
+        :param reason: the failure classification
+        :param message: the error message
+        :param stderr: anything ChemicalTagger printed to stderr
+        :return: None
+        """
+        destination = self.quarantine_dir / reason
+        destination.mkdir(parents=True, exist_ok=True)
+        source_text = self.source_directory / (paragraph_id + '.txt')
+        if source_text.is_file():
+            shutil.copy2(source_text, destination / source_text.name)
+        source_xml = self.source_directory / (paragraph_id + '.xml')
+        if reason != 'extraction' and source_xml.is_file():
+            shutil.move(str(source_xml), str(destination / source_xml.name))
+        with open(destination / (paragraph_id + '.stderr.txt'), 'w', encoding='utf-8') as f:
+            f.write(message + '\n\n' + (stderr or ''))
+
+    def _synparagraph(self, paragraph_id: str) -> SynParagraph:
+        return SynParagraph(paragraph_id, source_directory=self.source_directory, chemtagger_dir=self.chemtagger_dir,
+                            chemtagger_exec=self.chemtagger_exec, registry=self.registry,
+                            chemtagger_timeout=self.timeout)
+
+    def _load_original(self, original: str) -> Optional[SynParagraph]:
+        """
+        Reloads a paragraph processed in an earlier run from its XML, without ever running ChemicalTagger
+        :param original: the paragraph identifier
+        :return: the SynParagraph, or None if its XML is missing or can't be read
+        """
+        if not (self.source_directory / (original + '.xml')).is_file():
+            logging.warning(f'No ChemicalTagger XML for {original} in {self.source_directory}, can\'t reuse it')
+            return None
+        try:
+            return self._synparagraph(original)
+        except Exception as e:
+            logging.warning(f'Could not reload {original} from its XML, not reusing it: {e!r}')
+            return None
+
+    def _reuse_duplicate(self, paragraph_id: str, original: str, similarity: float,
+                         processed: Dict[str, SynParagraph]) -> Optional[SynParagraph]:
+        """
+        Makes a SynParagraph for a duplicate paragraph from the original's results
+        :param paragraph_id: the duplicate paragraph's identifier
+        :param original: the identifier of the paragraph it duplicates
+        :param similarity: the estimated similarity between the two
+        :param processed: the paragraphs processed so far in this run
+        :return: a shallow copy of the original's SynParagraph, pointing at the duplicate, with provenance columns,
+            or None if the original (from an earlier run) can't be reloaded
+        """
+        try:
+            source = processed[original]
+        except KeyError:
+            source = self._load_original(original)
+            if source is None:
+                return None
+        duplicate = copy(source)
+        duplicate.paper_indentifier = paragraph_id
+        duplicate.source_paragraph = self.source_directory / (paragraph_id + '.txt')
+        duplicate.duplicate_of = original
+        duplicate.raw_synthesis = source.raw_synthesis.assign(duplicate_of=original, similarity=similarity)
+        self.reused[paragraph_id] = {'original': original, 'similarity': similarity}
+        logging.info(f'{paragraph_id} duplicates {original} (similarity {similarity:.2f}), reusing its results')
+        return duplicate
+
+    def run(self, paragraph_ids: Iterable[str]) -> Dict[str, SynParagraph]:
+        """
+        Runs SynParagraph over each paragraph, recording and quarantining any that fail
+        :param paragraph_ids: the identifiers of the paragraphs (the text file names without '.txt')
+        :return: a dictionary of {paragraph identifier: SynParagraph} for the paragraphs that succeeded
+        """
+        output = {}
+        for paragraph_id in paragraph_ids:
+            try:
+                if self.dedup is not None:
+                    with open(self.source_directory / (paragraph_id + '.txt'), 'r', encoding='utf-8') as f:
+                        text = f.read()
+                    original = self.dedup.exact_match(text)
+                    duplicate = None
+                    if original is not None:
+                        duplicate = self._reuse_duplicate(paragraph_id, original, 1.0, output)
+                    if duplicate is None:
+                        signature = self.dedup.signature(text)
+                        similar, similarity = self.dedup.query(text, signature)
+                        if similar is not None and self.reuse_near_duplicates:
+                            duplicate = self._reuse_duplicate(paragraph_id, similar, similarity, output)
+                    if duplicate is not None:
+                        output[paragraph_id] = duplicate
+                        continue
+                output[paragraph_id] = self._synparagraph(paragraph_id)
+                self.succeeded.append(paragraph_id)
+                if self.dedup is not None:
+                    if similar is not None:
+                        output[paragraph_id].similar_to = similar
+                        self.near_duplicates[paragraph_id] = {'original': similar, 'similarity': similarity}
+                    self.dedup.add(paragraph_id, text, signature)
+            except ChemTaggerLaunchError:
+                raise
+            except ChemTaggerError as e:
+                logging.warning(f'ChemicalTagger failed on {paragraph_id} ({e.reason}): {e}')
+                self.failures[paragraph_id] = {'reason': e.reason, 'message': str(e)}
+                self._quarantine(paragraph_id, e.reason, str(e), e.stderr)
+            except Exception as e:
+                logging.warning(f'Sequence extraction failed on {paragraph_id}: {e!r}')
+                self.failures[paragraph_id] = {'reason': 'extraction', 'message': repr(e)}
+                self._quarantine(paragraph_id, 'extraction', traceback.format_exc())
+        logging.info(f'Tagging batch finished: {self.summary().to_dict()}')
+        return output
+
+    def summary(self) -> pd.Series:
+        """
+        Counts the paragraphs processed so far by outcome
+        :return: a Series of counts indexed by 'ok', 'reused' (duplicates), 'near_duplicate' (processed anyway, so
+            also counted in 'ok') and each failure reason
+        """
+        counts = pd.Series(0, index=['ok', 'reused', 'near_duplicate', *CHEMTAGGER_FAILURES, 'extraction'])
+        counts['ok'] = len(self.succeeded)
+        counts['reused'] = len(self.reused)
+        counts['near_duplicate'] = len(self.near_duplicates)
+        for failure in self.failures.values():
+            counts[failure['reason']] += 1
+        return counts
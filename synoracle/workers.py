@@ -0,0 +1,206 @@
+"""
+A module for running ChemDataExtractor over many papers in parallel without every worker loading its own models.
+The CDE part-of-speech tagger and chemical NER models are loaded once in the parent process, the garbage collector
+is frozen so those pages aren't written to (and copied) later, and then workers are forked to share them copy-on-write.
+
+Sharing only works where processes are forked, which is the default on Linux. On macOS forking is unsafe, so it is
+only used if asked for with start_method='fork'. Elsewhere (macOS by default, Windows) each worker falls back to
+loading the models itself when it starts.
+
+Classes:
+CDEWorkerPool - a process pool whose workers share preloaded ChemDataExtractor models
+
+Functions:
+preload_cde_models - loads the ChemDataExtractor models used by ExperimentalPaper into the current process
+process_memory - reports the unique (USS) and resident (RSS) memory of a process
+"""
+import gc
+import logging
+import multiprocessing as mp
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Union
+
+import pandas as pd
+
+# A short synthesis-like text, enough to make CDE load every model that ExperimentalPaper uses
+WARMUP_TEXT = 'Zinc nitrate hexahydrate (0.5 g, 1.7 mmol) was dissolved in 20 mL of methanol and stirred for 1 h.'
+
+
+def preload_cde_models(text: str = WARMUP_TEXT) -> float:
+    """
+    Loads the ChemDataExtractor tagger and NER models by processing a short piece of text, the same way
+    ExperimentalPaper.identify_key_paragraphs does (chemical mentions and part-of-speech tags).
+    CDE caches the models at module level, so later Documents in this process (and forked children) reuse them.
+    :param text: the text to warm the models up with
+    :return: the time taken, in seconds
+    """
+    from chemdataextractor import Document
+
+    start = time.perf_counter()
+    doc = Document(text)
+    for paragraph in doc.paragraphs:
+        paragraph.cems
+        for sentence in paragraph:
+            sentence.pos_tagged_tokens
+    elapsed = time.perf_counter() - start
+    logging.info(f'ChemDataExtractor models loaded in {elapsed:.1f} s')
+    return elapsed
+
+
+def process_memory(pid: int = None) -> Dict[str, float]:
+    """
+    Reads the memory use of a process from /proc (Linux only).
+    Unique set size (USS) is the memory only this process uses, i.e. what it would free if it exited;
+    pages still shared copy-on-write with the parent don't count towards it.
+    :param pid: the process ID, defaults to the current process
+    :return: a dictionary of 'pid', 'uss_mb' and 'rss_mb', with NaN values where /proc is unavailable
+    """
+    pid = pid or os.getpid()
+    output = {'pid': pid, 'uss_mb': float('nan'), 'rss_mb': float('nan')}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[0].endswith(':'):
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return output
+    output['uss_mb'] = (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024
+    output['rss_mb'] = fields.get('Rss', 0) / 1024
+    return output
+
+
+def _spawned_worker_init():
+    """ Worker initialiser for start methods that can't share memory: load the models in each worker instead"""
+    preload_cde_models()
+
+
+class CDEWorkerPool:
+    """
+    A process pool for running ChemDataExtractor-based work (e.g. ExperimentalPaper.create_cde_doc and
+    identify_key_paragraphs) across many papers. Use it as a context manager:
+
+        with CDEWorkerPool(processes=8) as pool:
+            candidates = pool.find_candidate_paragraphs(paper_ids, source_directory='./papers')
+            print(pool.memory_report())
+
+    Key methods:
+    : map: applies a function to every item in an iterable across the workers
+    : find_candidate_paragraphs: runs ExperimentalPaper paragraph identification over a list of papers
+    : worker_pids: lists the process IDs of the pool's workers
+    : memory_report: reports the unique and resident memory of the parent and each worker
+    """
+
+    def __init__(self, processes: int = None, preload: bool = True, start_method: str = None):
+        """
+        :param processes: the number of worker processes, defaults to the number of CPUs
+        :param preload: whether to load the CDE models before starting the workers
+        :param start_method: the multiprocessing start method, defaults to 'fork' on Linux and 'spawn' elsewhere
+        """
+        self.processes = processes or os.cpu_count()
+        if start_method is None:
+            start_method = 'fork' if sys.platform.startswith('linux') else 'spawn'
+        self.start_method = start_method
+        self.preload = preload
+        self.pool = None
+        self._froze_gc = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """
+        Loads the models (if forking), freezes the garbage collector and starts the workers
+        :return: None
+        """
+        context = mp.get_context(self.start_method)
+        initializer = None
+        if self.preload and self.start_method == 'fork':
+            preload_cde_models()
+            # Move everything loaded so far out of the collector's reach: collections in the workers would otherwise
+            # touch the object headers of the models and copy their pages.
+            gc.collect()
+            gc.freeze()
+            self._froze_gc = True
+        elif self.preload:
+            logging.warning(f"Models can't be shared with the '{self.start_method}' start method, "
+                            f"each worker will load its own")
+            initializer = _spawned_worker_init
+        self.pool = context.Pool(self.processes, initializer=initializer)
+
+    def close(self):
+        """ Shuts down the workers, and unfreezes the garbage collector if this pool froze it"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self._froze_gc:
+            gc.unfreeze()
+            self._froze_gc = False
+
+    def map(self, func: Callable, iterable: Iterable, chunksize: int = 1) -> list:
+        """
+        Applies a function to every item across the worker processes
+        :param func: a picklable (i.e. module-level) function
+        :param iterable: the items to process
+        :param chunksize: the number of items sent to a worker at a time
+        :return: a list of results, in order
+        """
+        if self.pool is None:
+            self.start()
+        return self.pool.map(func, iterable, chunksize)
+
+    def find_candidate_paragraphs(self, paper_ids: Iterable[str], source_directory: Union[str, Path] = Path('./')
+                                  ) -> Dict[str, Dict[int, str]]:
+        """
+        Runs create_cde_doc and identify_key_paragraphs on each paper in the workers
+        :param paper_ids: the paper identifiers
+        :param source_directory: the folder the papers are in
+        :return: a dictionary of {paper identifier: {paragraph index: paragraph text}}
+        """
+        paper_ids = list(paper_ids)
+        results = self.map(_candidate_paragraphs, [(x, str(source_directory)) for x in paper_ids])
+        return dict(zip(paper_ids, results))
+
+    def worker_pids(self) -> List[int]:
+        """
+        Lists the pool's own worker processes (not any other children, such as ChemicalTagger runs)
+        :return: a list of process IDs, empty if the pool isn't running
+        """
+        if self.pool is None:
+            return []
+        return [x.pid for x in self.pool._pool]
+
+    def memory_report(self) -> pd.DataFrame:
+        """
+        Reports the memory use of the parent and each worker process. A worker's unique memory (uss_mb) is what
+        it costs on top of the shared models, so it's the number to budget for when adding workers.
+        :return: a DataFrame with one row per process: role, pid, uss_mb and rss_mb
+        """
+        rows = [{'role': 'parent', **process_memory()}]
+        for pid in self.worker_pids():
+            rows.append({'role': 'worker', **process_memory(pid)})
+        return pd.DataFrame(rows, columns=['role', 'pid', 'uss_mb', 'rss_mb'])
+
+
+def _candidate_paragraphs(args) -> Dict[int, str]:
+    """
+    Worker function for CDEWorkerPool.find_candidate_paragraphs. Returns plain text since CDE objects don't pickle.
+    :param args: a tuple of (paper identifier, source directory)
+    :return: a dictionary of {paragraph index: paragraph text}
+    """
+    from synoracle.xptlpaper import ExperimentalPaper
+
+    paper_id, source_directory = args
+    paper = ExperimentalPaper(paper_id, source_directory=source_directory)
+    paper.create_cde_doc()
+    paper.identify_key_paragraphs()
+    return {k: v.text for k, v in paper.candidate_paragraphs.items()}
@@ -21,7 +21,7 @@ import pandas as pd
 from pathlib import Path
 from typing import Union
 from chemdataextractor import Document
-from chemdataextractor.doc import Sentence, Paragraph
+from chemdataextractor.doc import Sentence, Paragraph, Heading
 from itertools import tee
 import re
 from typing import Tuple
@@ -50,6 +50,7 @@ class ExperimentalPaper:
     : create_cde_doc: Creates a ChemDataExtractor document for later analysis
     : count_quantities: Performs a regex and part-of-speech search on a sentence in the CDE document
     : count_all_quantities: Performs count_quantities on all sentences within a paragraph
+    : rank_paragraphs: Scores paragraphs with a cheap heuristic (section heading, position, quantity density)
     : identify_key_paragraphs: Uses count_all_quantities to identify likely synthesis paragraphs within the paper
     : output_paragraphs: Writes the raw text of paragraphs identified by identify_key_paragraphs to file
 
@@ -170,11 +171,72 @@ class ExperimentalPaper:
 
     # endregion
 
-    def identify_key_paragraphs(self):
+    # region paragraph ranking
+    _good_headings = re.compile(r'experimental|synthes[ie]s|preparation|procedure|method|materials', re.IGNORECASE)
+    _bad_headings = re.compile(r'introduction|conclusion|reference|acknowledg|abstract|author|funding|conflict',
+                               re.IGNORECASE)
+    _quantity_like = re.compile(r'\d+(?:[.,]\d+)?\s?(?:(?:[mµμnk]?(?:g|L|l|mol|M)|K|h|min|rpm)\b|°\s?C\b|wt\s?%|%)')
+
+    def _paragraph_headings(self) -> list:
+        """
+        Finds the text of the most recent heading before each paragraph in the CDE document
+        :return: a list of heading strings (empty if none), in the same order as cde_doc.paragraphs
+        """
+        headings = []
+        current = ''
+        for element in self.cde_doc.elements:
+            if isinstance(element, Heading):
+                current = element.text
+            elif isinstance(element, Paragraph):
+                headings.append(current)
+        return headings
+
+    def rank_paragraphs(self) -> pd.DataFrame:
+        """
+        Scores each paragraph on how likely it is to be a synthesis, without any POS tagging or NER. The score adds:
+        - +2 for a heading like 'Experimental' or 'Synthesis', -2 for one like 'Introduction' or 'References'
+        - -1 for paragraphs in the first or last 10% of the document (abstract, introduction, back matter)
+        - the number of quantity-like strings (e.g. '0.5 g', '65 °C') per 50 words, capped at 3
+        :return: a DataFrame indexed by paragraph number, with heading, position, density and score, sorted by score
+        """
+        paragraphs = self.cde_doc.paragraphs
+        rows = []
+        for c, (paragraph, heading) in enumerate(zip(paragraphs, self._paragraph_headings())):
+            text = paragraph.text
+            position = c / max(len(paragraphs) - 1, 1)
+            density = len(self._quantity_like.findall(text)) / max(len(text.split()), 1) * 50
+            score = min(density, 3)
+            if self._good_headings.search(heading):
+                score += 2
+            elif self._bad_headings.search(heading):
+                score -= 2
+            if position < 0.1 or position > 0.9:
+                score -= 1
+            rows.append({'paragraph': c, 'heading': heading, 'position': position, 'density': density,
+                         'score': score})
+        ranking = pd.DataFrame(rows, columns=['paragraph', 'heading', 'position', 'density', 'score'])
+        return ranking.set_index('paragraph').sort_values('score', ascending=False, kind='stable')
+
+    # endregion
+
+    def _is_key_paragraph(self, paragraph: Paragraph) -> bool:
+        """ The full (expensive) synthesis paragraph check: more than two chemical mentions and quantities"""
+        if len(paragraph.cems) > 2:
+            names, quantities = self.count_all_quantities(paragraph)
+            logging.debug(quantities, names)
+            if quantities > 2:
+                return True
+        return False
+
+    def identify_key_paragraphs(self, top_k: int = None, min_score: float = None):
         """
         Iterates through the entire manuscript as a CDE document, counting chemical mentions and physical quantities.
         Creates a dictionary of candidate paragraphs in the form {paper paragraph index: paragraph.
+        If top_k is given, paragraphs are checked in order of rank_paragraphs score instead, stopping once top_k
+        paragraphs qualify or the scores drop below min_score. The ranking is kept as self.paragraph_ranking.
         TODO: add in fnuctionality to see what has been identified within the output dict?
+        :param top_k: the number of synthesis paragraphs wanted; None checks every paragraph
+        :param min_score: in ranked mode, the score below which paragraphs aren't checked at all
         :return: None
         """
         try:
@@ -184,13 +246,24 @@ class ExperimentalPaper:
 
         self.candidate_paragraphs = {}
 
-        for c, paragraph in enumerate(self.cde_doc.paragraphs):
-            if len(paragraph.cems) > 2:
-
-                names,quantities = self.count_all_quantities(paragraph)
-                logging.debug(quantities, names)
-                if quantities > 2:
+        if top_k is None:
+            for c, paragraph in enumerate(self.cde_doc.paragraphs):
+                if self._is_key_paragraph(paragraph):
                     self.candidate_paragraphs[c] = paragraph
+            return
+
+        self.paragraph_ranking = self.rank_paragraphs()
+        paragraphs = self.cde_doc.paragraphs
+        checked = 0
+        for c, score in self.paragraph_ranking['score'].items():
+            if len(self.candidate_paragraphs) >= top_k or (min_score is not None and score < min_score):
+                break
+            checked += 1
+            if self._is_key_paragraph(paragraphs[c]):
+                self.candidate_paragraphs[c] = paragraphs[c]
+        logging.info(f'Found {len(self.candidate_paragraphs)} synthesis paragraph(s) after checking {checked} of '
+                     f'{len(paragraphs)}')
+        self.candidate_paragraphs = dict(sorted(self.candidate_paragraphs.items()))
 
     def output_paragraphs(self, output_dir: Union[str, Path]=None, paragraph_keys = None):
         """